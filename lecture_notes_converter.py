@@ -8,30 +8,136 @@ GitHub: https://github.com/gianelli-lagos/lecture-notes-converter
 """
 
 import argparse
+import functools
+import importlib.util
 import sys
+import time
 from pathlib import Path
 
 try:
-    from pypdf import PdfReader, PdfWriter
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import letter
+    import pikepdf
+    # reportlab is imported lazily by _reportlab(); just check it's there
+    if importlib.util.find_spec("reportlab") is None:
+        raise ImportError("No module named 'reportlab'")
     import io
 except ImportError:
     print("📦 Installing required packages...")
     import subprocess
     try:
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "pypdf", "reportlab", "--break-system-packages"])
-        from pypdf import PdfReader, PdfWriter
-        from reportlab.pdfgen import canvas
-        from reportlab.lib.pagesizes import letter
+        subprocess.check_call([sys.executable, "-m", "pip", "install", "pikepdf", "reportlab", "--break-system-packages"])
+        import pikepdf
         import io
         print("✓ Packages installed successfully!\n")
     except Exception as e:
         print(f"❌ Failed to install packages: {e}")
-        print("Please run manually: pip install pypdf reportlab")
+        print("Please run manually: pip install pikepdf reportlab")
         sys.exit(1)
 
 
+@functools.cache
+def _reportlab():
+    """
+    Import reportlab on first use.
+    
+    It's only needed to measure text and draw the static overlay, so --help
+    doesn't pay for it.
+    
+    Returns:
+        (canvas, pdfmetrics, letter)
+    """
+    from reportlab.pdfgen import canvas
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.lib.pagesizes import letter
+    return canvas, pdfmetrics, letter
+
+
+def _fit_slide(orig_width, orig_height, slides_width, slide_height, y_positions):
+    """
+    Scale a slide to fit its slot, preserving aspect ratio.
+    
+    Returns:
+        (scaled_width, scaled_height, x_offset, y_offsets) where y_offsets
+        has the bottom edge of the slide for each slot on the page
+    """
+    # Use 98% of available space to add small margins
+    scale_x = (slides_width / orig_width) * 0.98
+    scale_y = (slide_height / orig_height) * 0.98
+    scale = min(scale_x, scale_y)
+    
+    scaled_width = orig_width * scale
+    scaled_height = orig_height * scale
+    
+    # Center horizontally in slide area
+    x_offset = (slides_width - scaled_width) / 2
+    # Center vertically in each slide slot
+    y_offsets = tuple(y_position + (slide_height - scaled_height) / 2 for y_position in y_positions)
+    return scaled_width, scaled_height, x_offset, y_offsets
+
+
+def _count_links(page):
+    """
+    Count the link annotations on a page.
+    """
+    return sum(1 for annot in page.obj.get('/Annots', ()) if annot.get('/Subtype') == pikepdf.Name.Link)
+
+
+def _render_static_overlay(slides_in_batch, params):
+    """
+    Render the parts of a page that don't depend on which slides are on it.
+    
+    Args:
+        slides_in_batch: Number of slides on the page (only the last page
+            of a deck can have fewer than slides_per_page)
+        params: Layout parameters (see create_combined_pdf)
+    
+    Returns:
+        Borders, separator line and NOTES header as a single-page PDF (bytes)
+    """
+    page_width, page_height = params['page_size']
+    slides_width = params['slides_width']
+    slide_height = params['slide_height']
+    y_positions = params['y_positions']
+    show_borders = params['show_borders']
+    notes_label = params['notes_label']
+    label_x = params['label_x']
+    show_separator = params['show_separator']
+    separator_color = params['separator_color']
+    
+    packet = io.BytesIO()
+    canvas, _, _ = _reportlab()
+    can = canvas.Canvas(packet, pagesize=(page_width, page_height))
+    
+    # Draw slide borders if requested, as a single path
+    if show_borders:
+        can.setStrokeColorRGB(0.8, 0.8, 0.8)
+        can.setLineWidth(0.5)
+        borders = can.beginPath()
+        for y_position in y_positions[:slides_in_batch]:
+            borders.rect(0, y_position, slides_width, slide_height)
+        can.drawPath(borders, stroke=1, fill=0)
+    
+    # Calculate where the vertical line should end (at the last slide)
+    last_slide_y_position = page_height - slides_in_batch * slide_height
+    
+    # Draw vertical separator line between slides and notes (only as far as slides go)
+    if show_separator:
+        # Use custom color or default gray
+        if separator_color:
+            can.setStrokeColorRGB(*separator_color)
+        else:
+            can.setStrokeColorRGB(0.6, 0.6, 0.6)
+        can.setLineWidth(1)
+        can.line(slides_width, last_slide_y_position, slides_width, page_height)
+    
+    # Add header in notes section
+    can.setFont("Helvetica-Bold", 9)
+    can.setFillColorRGB(0.3, 0.3, 0.3)
+    can.drawString(label_x, page_height - 20, notes_label)
+    
+    can.save()
+    return packet.getvalue()
+
+
 def create_combined_pdf(input_pdf_path, output_pdf_path, slides_per_page=5, 
                        note_space_ratio=0.3, show_borders=False, custom_label=None,
                        show_page_numbers=True, show_slide_numbers=True, 
@@ -51,15 +157,18 @@ def create_combined_pdf(input_pdf_path, output_pdf_path, slides_per_page=5,
         show_separator: Show vertical line between slides and notes (default: True)
         separator_color: RGB tuple for separator line (default: gray (0.6, 0.6, 0.6))
     """
-    # Read the input PDF
+    _, pdfmetrics, letter = _reportlab()
+    
+    # Read the input PDF, memory-mapped so page lookups read straight from
+    # the OS page cache
     try:
-        reader = PdfReader(input_pdf_path)
+        src = pikepdf.open(input_pdf_path, access_mode=pikepdf.AccessMode.mmap)
     except Exception as e:
         raise ValueError(f"Failed to read PDF: {e}")
     
-    writer = PdfWriter()
+    out = pikepdf.Pdf.new()
     
-    total_slides = len(reader.pages)
+    total_slides = len(src.pages)
     
     if total_slides == 0:
         raise ValueError("PDF has no pages")
@@ -76,125 +185,189 @@ def create_combined_pdf(input_pdf_path, output_pdf_path, slides_per_page=5,
     # Calculate slide dimensions
     slide_height = page_height / slides_per_page
     
-    # Process slides in batches
-    pages_created = 0
-    for batch_start in range(0, total_slides, slides_per_page):
-        # Create a new blank page
-        packet = io.BytesIO()
-        can = canvas.Canvas(packet, pagesize=letter)
-        
+    # Read every slide and its dimensions once, and compute the fit once per
+    # distinct size (lecture decks usually have just one)
+    pages = list(src.pages)
+    dims = []
+    for page in pages:
+        mediabox = pikepdf.Rectangle(page.mediabox)
+        width, height = float(mediabox.width), float(mediabox.height)
+        # Slides are drawn the way they're displayed, so a slide rotated by
+        # a quarter turn needs a slot of the rotated shape
+        if page.rotation % 180 == 90:
+            width, height = height, width
+        dims.append((width, height))
+    # Header text for the notes section, centered in the notes area. The
+    # width comes from the font metrics, so no canvas is needed for it.
+    notes_label = f"{custom_label} NOTES" if custom_label else "NOTES"
+    label_width = pdfmetrics.stringWidth(notes_label, "Helvetica-Bold", 11)
+    label_x = slides_width + (notes_width - label_width) / 2
+    
+    # Bottom edge of each slide slot, top to bottom
+    y_positions = tuple(page_height - (i + 1) * slide_height for i in range(slides_per_page))
+    placements = {
+        orig: _fit_slide(*orig, slides_width, slide_height, y_positions) for orig in set(dims)
+    }
+    
+    # Where each slide goes on its page. A slide's slot only depends on its
+    # index, so the whole table can be built up front from the placements.
+    slot_rects = {
+        orig: [
+            pikepdf.Rectangle(x_offset, y_offset, x_offset + scaled_width, y_offset + scaled_height)
+            for y_offset in y_offsets
+        ]
+        for orig, (scaled_width, scaled_height, x_offset, y_offsets) in placements.items()
+    }
+    slide_rects = [
+        slot_rects[orig][slide_idx % slides_per_page]
+        for slide_idx, orig in enumerate(dims)
+    ]
+    
+    params = {
+        'page_size': (page_width, page_height),
+        'slides_width': slides_width,
+        'slide_height': slide_height,
+        'y_positions': y_positions,
+        'show_borders': show_borders,
+        'notes_label': notes_label,
+        'label_x': label_x,
+        'show_separator': show_separator,
+        'separator_color': separator_color,
+    }
+    
+    # Render the static part of each page once: one version for full pages,
+    # plus one for a shorter last page if the slides don't divide evenly.
+    # Each is copied into the output as a single Form XObject that every
+    # page shares. The template documents must stay open until the output
+    # is saved.
+    static_pdfs = {
+        slides_in_batch: pikepdf.open(io.BytesIO(_render_static_overlay(slides_in_batch, params)))
+        for slides_in_batch in {slides_per_page, total_slides % slides_per_page or slides_per_page}
+    }
+    static_forms = {
+        slides_in_batch: out.copy_foreign(static_pdf.pages[0].as_form_xobject())
+        for slides_in_batch, static_pdf in static_pdfs.items()
+    }
+    
+    # Lay out the batches, with each page's labels worked out up front so
+    # building the page only draws them
+    batches = []
+    for page_num, batch_start in enumerate(range(0, total_slides, slides_per_page), 1):
         batch_end = min(batch_start + slides_per_page, total_slides)
-        slides_in_batch = batch_end - batch_start
         
-        # Draw slide borders if requested
-        if show_borders:
-            can.setStrokeColorRGB(0.8, 0.8, 0.8)
-            can.setLineWidth(0.5)
-            for i in range(slides_in_batch):
-                y_position = page_height - (i + 1) * slide_height
-                can.rect(0, y_position, slides_width, slide_height)
+        page_label = None
+        if show_page_numbers:
+            page_text = f"Page {page_num}"
+            page_label = (page_text, page_width - 10 - pdfmetrics.stringWidth(page_text, "Helvetica", 8))
         
-        # Calculate where the vertical line should end (at the last slide)
-        last_slide_y_position = page_height - slides_in_batch * slide_height
+        slide_range = None
+        if show_slide_numbers:
+            slide_range_text = f"Slides {batch_start + 1}-{batch_end}" if batch_end > batch_start + 1 else f"Slide {batch_start + 1}"
+            slide_range_width = pdfmetrics.stringWidth(slide_range_text, "Helvetica", 8)
+            slide_range_x = slides_width + (notes_width - slide_range_width) / 2
+            slide_range = (slide_range_text, slide_range_x)
         
-        # Draw vertical separator line between slides and notes (only as far as slides go)
-        if show_separator:
-            # Use custom color or default gray
-            if separator_color:
-                can.setStrokeColorRGB(*separator_color)
-            else:
-                can.setStrokeColorRGB(0.6, 0.6, 0.6)
-            can.setLineWidth(1)
-            can.line(slides_width, last_slide_y_position, slides_width, page_height)
+        batches.append((batch_start, batch_end, page_label, slide_range))
+    
+    # One Helvetica font dictionary for the labels, shared by every page
+    font = out.make_indirect(pikepdf.Dictionary(
+        Type=pikepdf.Name.Font,
+        Subtype=pikepdf.Name.Type1,
+        BaseFont=pikepdf.Name.Helvetica,
+        Encoding=pikepdf.Name.WinAnsiEncoding,
+    ))
+    
+    # Process slides in batches, one after another, all in the one output
+    # document. qpdf only shares objects copied from the same source Pdf, so
+    # building pages in separate (e.g. worker process) documents would copy
+    # every resource the slides share once per document.
+    pages_created = 0
+    last_print = 0.0
+    for batch_start, batch_end, page_label, slide_range in batches:
+        slides_in_batch = batch_end - batch_start
         
-        # Add header in notes section
-        notes_label = f"{custom_label} NOTES" if custom_label else "NOTES"
-        can.setFont("Helvetica-Bold", 9)
-        can.setFillColorRGB(0.3, 0.3, 0.3)
+        base_page = out.add_blank_page(page_size=(page_width, page_height))
         
-        # Center the label in the notes area
-        label_width = can.stringWidth(notes_label, "Helvetica-Bold", 11)
-        label_x = slides_width + (notes_width - label_width) / 2
-        can.drawString(label_x, page_height - 20, notes_label)
+        # The whole page is a single content stream built here: the pre-rendered
+        # static elements, the page's labels, then each slide drawn as a Form
+        # XObject. Each piece is wrapped in q/Q so no graphics state leaks
+        # into the next.
+        xobjects = pikepdf.Dictionary(Tpl=static_forms[slides_in_batch])
+        content = [b"q /Tpl Do Q"]
         
         # Add slide range indicator below NOTES header (centered)
-        if show_slide_numbers:
-            can.setFont("Helvetica", 7)
-            can.setFillColorRGB(0.5, 0.5, 0.5)
-            slide_range = f"Slides {batch_start + 1}-{batch_end}" if batch_end > batch_start + 1 else f"Slide {batch_start + 1}"
-            slide_range_width = can.stringWidth(slide_range, "Helvetica", 8)
-            slide_range_x = slides_width + (notes_width - slide_range_width) / 2
-            can.drawString(slide_range_x, page_height - 35, slide_range)
+        if slide_range:
+            slide_range_text, slide_range_x = slide_range
+            content.append(b"q BT /F1 7 Tf 0.5 0.5 0.5 rg %.2f %.2f Td %s Tj ET Q" % (
+                slide_range_x, page_height - 35, pikepdf.String(slide_range_text).unparse()))
         
         # Add page number at bottom right
-        if show_page_numbers:
-            can.setFont("Helvetica", 8)
-            can.setFillColorRGB(0.5, 0.5, 0.5)
-            page_num = pages_created + 1
-            can.drawRightString(page_width - 10, 10, f"Page {page_num}")
-        
-        can.save()
-        
-        # Create the base page
-        packet.seek(0)
-        base_pdf = PdfReader(packet)
-        base_page = base_pdf.pages[0]
+        if page_label:
+            page_label_text, page_label_x = page_label
+            content.append(b"q BT /F1 8 Tf 0.5 0.5 0.5 rg %.2f %.2f Td %s Tj ET Q" % (
+                page_label_x, 10, pikepdf.String(page_label_text).unparse()))
         
-        # Add the actual slide content
-        for i, slide_idx in enumerate(range(batch_start, batch_end)):
-            original_slide = reader.pages[slide_idx]
-            
-            # Get original slide dimensions
-            orig_width = float(original_slide.mediabox.width)
-            orig_height = float(original_slide.mediabox.height)
-            
-            # Calculate scaling to fit the slide into allocated space
-            # Use 98% of available space to add small margins
-            scale_x = (slides_width / orig_width) * 0.98
-            scale_y = (slide_height / orig_height) * 0.98
-            scale = min(scale_x, scale_y)
-            
-            # Calculate position to center the slide in its space
-            y_position = page_height - (i + 1) * slide_height
+        # Add the actual slide content, placing each source page by reference
+        # rather than copying its content stream
+        for slide_idx in range(batch_start, batch_end):
+            name = pikepdf.Name(f"/Fm{slide_idx}")
+            formx = pages[slide_idx].as_form_xobject()
+            xobjects[name] = out.copy_foreign(formx)
+            matrix = base_page.get_matrix_for_form_xobject_placement(
+                formx, slide_rects[slide_idx], allow_shrink=True, allow_expand=True)
+            content.append(b"q %s cm %s Do Q" % (matrix.encode(), name.unparse()))
             
-            scaled_width = orig_width * scale
-            scaled_height = orig_height * scale
-            
-            # Center horizontally in slide area
-            x_offset = (slides_width - scaled_width) / 2
-            # Center vertically in slide slot
-            y_offset = y_position + (slide_height - scaled_height) / 2
-            
-            # Merge the slide onto the base page
-            base_page.merge_transformed_page(
-                original_slide,
-                [scale, 0, 0, scale, x_offset, y_offset]
-            )
+            # Bring the slide's links (and any other annotations) along, mapped
+            # through the form's own /Matrix (rotation, UserUnit) and then the
+            # placement, so they sit where the slide is drawn
+            if '/Annots' in pages[slide_idx].obj:
+                base_page.copy_annotations(pages[slide_idx], pikepdf.Matrix(formx.Matrix) @ matrix)
+        
+        base_page.Resources = pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font), XObject=xobjects)
+        base_page.Contents = out.make_stream(b"\n".join(content))
         
-        writer.add_page(base_page)
         pages_created += 1
         
-        # Progress indicator
-        progress = (batch_end / total_slides) * 100
-        print(f"  ⏳ Progress: {progress:.0f}% ({batch_end}/{total_slides} slides)", end='\r')
+        # Progress indicator, limited to ~20 updates per second
+        now = time.monotonic()
+        done = batch_end == total_slides
+        if now - last_print > 0.05 or done:
+            progress = (batch_end / total_slides) * 100
+            print(f"  ⏳ Progress: {progress:.0f}% ({batch_end}/{total_slides} slides)", end='\r', flush=done)
+            last_print = now
     
     print("")
     
-    # Write the output PDF
+    # Write the output PDF through a 1 MiB buffer so the many small object
+    # writes pikepdf makes are coalesced into a few large ones. Packing
+    # objects into compressed object streams keeps the file small.
     try:
-        with open(output_pdf_path, 'wb') as output_file:
-            writer.write(output_file)
+        with open(output_pdf_path, 'wb', buffering=1 << 20) as output_file:
+            out.save(
+                output_file,
+                linearize=False,
+                object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                compress_streams=True,
+                stream_decode_level=pikepdf.StreamDecodeLevel.generalized,
+            )
     except Exception as e:
         raise ValueError(f"Failed to write output PDF: {e}")
     
+    # Count links on both sides, so a conversion that loses any shows it
+    links_in = sum(_count_links(page) for page in pages)
+    links_out = sum(_count_links(page) for page in out.pages)
+    
     # Success summary!!
-    print(f"\n✅ Successfully created: {output_pdf_path}")
-    print(f"   📊 Stats:")
-    print(f"      • Original slides: {total_slides}")
-    print(f"      • Output pages: {pages_created}")
-    print(f"      • Slides per page: {slides_per_page}")
-    print(f"      • Note space: {int(note_space_ratio * 100)}% of page width")
-    print(f"      • Compression: {total_slides}→{pages_created} pages ({(1 - pages_created/total_slides)*100:.0f}% reduction)")
+    sys.stdout.write(
+        f"\n✅ Successfully created: {output_pdf_path}\n"
+        "   📊 Stats:\n"
+        f"      • Original slides: {total_slides}\n"
+        f"      • Output pages: {pages_created}\n"
+        f"      • Slides per page: {slides_per_page}\n"
+        f"      • Note space: {int(note_space_ratio * 100)}% of page width\n"
+        f"      • Compression: {total_slides}→{pages_created} pages ({(1 - pages_created/total_slides)*100:.0f}% reduction)\n"
+        + (f"      • Links: {links_out}/{links_in} kept\n" if links_in else "")
+    )
 
 
 def main():
@@ -249,9 +422,10 @@ Available Emojis: brain (🧠), rocket (🚀), star (⭐), fire (🔥), book (
     
     args = parser.parse_args()
     
-    # Validate input file
+    # Validate everything that doesn't need the user first, so bad arguments
+    # fail right away instead of after an overwrite prompt
     input_path = Path(args.input)
-    if not input_path.exists():
+    if not input_path.is_file():
         print(f"❌ Error: Input file not found: {args.input}")
         return 1
     
@@ -259,6 +433,15 @@ Available Emojis: brain (🧠), rocket (🚀), star (⭐), fire (🔥), book (
         print(f"❌ Error: Input file must be a PDF, got: {input_path.suffix}")
         return 1
     
+    # Validate parameters
+    if args.slides < 1 or args.slides > 10:
+        print(f"❌ Error: Slides per page must be between 1 and 10, got: {args.slides}")
+        return 1
+    
+    if not 0 < args.note_space < 1:
+        print(f"❌ Error: Note space ratio must be between 0 and 1, got: {args.note_space}")
+        return 1
+    
     # Determine output path
     if args.output:
         output_path = Path(args.output)
@@ -267,20 +450,18 @@ Available Emojis: brain (🧠), rocket (🚀), star (⭐), fire (🔥), book (
     
     # Check if output file already exists
     if output_path.exists():
-        response = input(f"⚠️  Output file already exists: {output_path}\n   Overwrite? [y/N]: ")
+        if output_path.samefile(input_path):
+            print(f"❌ Error: Output file would overwrite the input: {output_path}")
+            return 1
+        try:
+            response = input(f"⚠️  Output file already exists: {output_path}\n   Overwrite? [y/N]: ")
+        except EOFError:
+            # No one to answer (e.g. stdin is not a terminal), so don't overwrite
+            response = ''
         if response.lower() not in ['y', 'yes']:
             print("❌ Cancelled")
             return 0
     
-    # Validate parameters
-    if args.slides < 1 or args.slides > 10:
-        print(f"❌ Error: Slides per page must be between 1 and 10, got: {args.slides}")
-        return 1
-    
-    if not 0 < args.note_space < 1:
-        print(f"❌ Error: Note space ratio must be between 0 and 1, got: {args.note_space}")
-        return 1
-    
     # Build custom label with emoji if specified
     custom_label = args.label
     if args.emoji: